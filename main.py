@@ -1,19 +1,34 @@
+from __future__ import annotations
+
 import contextlib
+import functools
 import os
+import queue
 import random
+import re
+import sched
 import sqlite3
+import sys
+import threading
 import time
 import traceback
-from datetime import datetime, timedelta
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Optional
+from types import TracebackType
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import quote, urlparse
 
-import requests
-import schedule
-from camoufox import Camoufox
 from dotenv import load_dotenv
-from playwright._impl import _errors as pw_errors
-from playwright.sync_api import Page
+
+# Тяжелые модули импортируются в функциях, которые их используют, чтобы работа с базой не поднимала браузер
+if TYPE_CHECKING:
+    import requests
+    from playwright.sync_api import BrowserContext, Page, Request
+    from urllib3 import BaseHTTPResponse
 
 load_dotenv()
 
@@ -23,6 +38,20 @@ ACCOUNT_DELAY_MINUTES = int(os.getenv("ACCOUNT_DELAY_MINUTES", 30))
 MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
 TIMEOUT = int(os.getenv("TIMEOUT", 15000))
 CHECK_INTERVAL_MINUTES = 10  # Интервал проверки аккаунтов
+HOST_REQUESTS_PER_MINUTE = float(os.getenv("HOST_REQUESTS_PER_MINUTE", 2))  # Лимит проверок аккаунтов на один хост
+HOST_BURST = int(os.getenv("HOST_BURST", 2))
+# Дольше этого проверка не ждет лимит хоста, а откладывает аккаунт до следующего цикла
+HOST_MAX_WAIT_SECONDS = float(os.getenv("HOST_MAX_WAIT_SECONDS", 5))
+# Отключать в браузерах проверки картинки, веб-шрифты, автовоспроизведение медиа и трекеры
+BLOCK_RESOURCES = os.getenv("BLOCK_RESOURCES", "1") == "1"
+# JSON-эндпоинт со слотами (плейсхолдер {location}); без него проверка идет только через интерфейс
+SLOTS_API_URL = os.getenv("SLOTS_API_URL")
+
+_TG_BASE = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+_TG_MSG_URL = f"{_TG_BASE}/sendMessage"
+_TG_DOC_URL = f"{_TG_BASE}/sendDocument"
+# Дольше не ждем по Retry-After от Telegram: уведомление отправляется из потока проверки
+_TG_MAX_RETRY_AFTER = 10
 
 
 def log(message: str) -> None:
@@ -31,17 +60,92 @@ def log(message: str) -> None:
     print(f"[{timestamp}] {message}")
 
 
+@functools.cache
+def telegram_session() -> requests.Session:
+    """Общая сессия для Telegram API: соединение с api.telegram.org переиспользуется между уведомлениями,
+    а на 429/5xx выполняются повторные попытки с учетом заголовка Retry-After"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class CappedRetry(Retry):
+        """Retry с ограниченным ожиданием по Retry-After"""
+
+        def get_retry_after(self, response: BaseHTTPResponse) -> Optional[float]:
+            retry_after = super().get_retry_after(response)
+            return None if retry_after is None else min(retry_after, _TG_MAX_RETRY_AFTER)
+
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=4,
+            max_retries=CappedRetry(
+                total=3,
+                backoff_factor=1,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=None,
+                respect_retry_after_header=True,
+            ),
+        ),
+    )
+    return session
+
+
+# Явные преобразования datetime <-> TIMESTAMP: встроенные адаптер и конвертер sqlite3 устарели с Python 3.12
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+# Тексты запросов неизменны, поэтому sqlite3 берет подготовленные выражения из кэша соединения
+_SQL_ADD_ACCOUNT = "INSERT INTO accounts (login_url, password, location) VALUES (?, ?, ?)"
+_SQL_GET_ACTIVE = """
+    SELECT id, login_url, password, location, consecutive_429
+    FROM accounts
+    WHERE is_blocked = 0 OR (next_check IS NOT NULL AND next_check <= ?)
+    ORDER BY COALESCE(last_check, '1970-01-01') ASC
+"""
+_SQL_UPDATE_STATUS = "UPDATE accounts SET last_check = ?, next_check = ?, is_blocked = ? WHERE id = ?"
+_SQL_REGISTER_429 = """
+    UPDATE accounts
+    SET last_check = ?, next_check = ?, is_blocked = 1, consecutive_429 = consecutive_429 + 1
+    WHERE id = ?
+"""
+_SQL_RESET_429 = "UPDATE accounts SET consecutive_429 = 0 WHERE id = ?"
+
+
 class AccountDB:
     """Класс для работы с базой данных аккаунтов"""
 
-    def __init__(self, db_path: str = "accounts.db") -> None:
-        self.conn = sqlite3.connect(db_path)
+    def __init__(self, db_path: str = "accounts.db", readers: int = 4) -> None:
+        # Одно соединение на запись под блокировкой и пул соединений только для чтения
+        self._lock = threading.Lock()
+        self._writer = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
         self._create_table()
 
+        read_only_uri = f"{Path(db_path).absolute().as_uri()}?mode=ro"
+        self._readers: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(readers):
+            reader = sqlite3.connect(
+                read_only_uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+            )
+            reader.row_factory = sqlite3.Row
+            reader.execute("PRAGMA cache_size=-64000")
+            self._readers.put(reader)
+
     def _create_table(self) -> None:
         """Создает таблицу accounts если она не существует"""
-        with self.conn:
-            self.conn.execute(
+        for pragma in (
+            "PRAGMA journal_mode=WAL",
+            "PRAGMA synchronous=NORMAL",
+            "PRAGMA temp_store=MEMORY",
+            "PRAGMA mmap_size=30000000000",
+            "PRAGMA cache_size=-64000",
+        ):
+            self._writer.execute(pragma)
+
+        with self._lock, self._writer:
+            self._writer.execute(
                 """
                 CREATE TABLE IF NOT EXISTS accounts (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,74 +155,75 @@ class AccountDB:
                     last_check TIMESTAMP,
                     next_check TIMESTAMP,
                     is_blocked BOOLEAN DEFAULT FALSE,
+                    consecutive_429 INTEGER NOT NULL DEFAULT 0,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """
             )
+            # Миграция баз, созданных до появления счетчика 429
+            columns = {row[1] for row in self._writer.execute("PRAGMA table_info(accounts)")}
+            if "consecutive_429" not in columns:
+                self._writer.execute("ALTER TABLE accounts ADD COLUMN consecutive_429 INTEGER NOT NULL DEFAULT 0")
+            self._writer.execute(
+                "CREATE INDEX IF NOT EXISTS idx_accounts_next ON accounts (is_blocked, next_check, last_check)"
+            )
+
+    @contextlib.contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        """Выдает соединение только для чтения из пула"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
 
     def add_account(self, login_url: str, password: str, location: str) -> None:
         """Добавляет новый аккаунт в базу данных"""
-        with self.conn:
-            self.conn.execute(
-                "INSERT INTO accounts (login_url, password, location) VALUES (?, ?, ?)",
-                (login_url, password, location),
-            )
+        with self._lock, self._writer:
+            self._writer.execute(_SQL_ADD_ACCOUNT, (login_url, password, location))
+
+    def add_accounts(self, accounts: list[tuple[str, str, str]]) -> None:
+        """Добавляет несколько аккаунтов (login_url, password, location) одной транзакцией"""
+        with self._lock, self._writer:
+            self._writer.executemany(_SQL_ADD_ACCOUNT, accounts)
 
     def get_active_accounts(self) -> list[dict]:
         """Возвращает список активных аккаунтов, готовых к проверке"""
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with self.conn:
-            cursor = self.conn.execute(
-                """
-                SELECT id, login_url, password, location, last_check, next_check, is_blocked 
-                FROM accounts 
-                WHERE is_blocked = FALSE OR next_check <= ?
-                ORDER BY last_check ASC
-            """,
-                (now,),
-            )
-
-            accounts = []
-            for row in cursor.fetchall():
-                accounts.append(
-                    {
-                        "id": row[0],
-                        "login_url": row[1],
-                        "password": row[2],
-                        "location": row[3],
-                        "last_check": datetime.strptime(row[4], "%Y-%m-%d %H:%M:%S") if row[4] else None,
-                        "next_check": datetime.strptime(row[5], "%Y-%m-%d %H:%M:%S") if row[5] else None,
-                        "is_blocked": bool(row[6]),
-                    }
-                )
-            return accounts
+        now = datetime.now()
+        with self._read() as conn:
+            return [dict(row) for row in conn.execute(_SQL_GET_ACTIVE, (now,))]
 
     def update_account_status(self, account_id: int, is_blocked: bool = False, next_check: datetime = None) -> None:
         """Обновляет статус аккаунта после проверки"""
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        next_check_str = next_check.strftime("%Y-%m-%d %H:%M:%S") if next_check else None
+        now = datetime.now()
 
-        with self.conn:
-            self.conn.execute(
-                """
-                UPDATE accounts 
-                SET last_check = ?, 
-                    next_check = ?, 
-                    is_blocked = ? 
-                WHERE id = ?
-            """,
-                (now, next_check_str, is_blocked, account_id),
-            )
+        with self._lock, self._writer:
+            self._writer.execute(_SQL_UPDATE_STATUS, (now, next_check, is_blocked, account_id))
+
+    def register_429(self, account_id: int, next_check: datetime) -> None:
+        """Приостанавливает аккаунт после 429 ошибки и увеличивает счетчик таких ошибок подряд"""
+        with self._lock, self._writer:
+            self._writer.execute(_SQL_REGISTER_429, (datetime.now(), next_check, account_id))
+
+    def reset_429(self, account_id: int) -> None:
+        """Сбрасывает счетчик 429 ошибок подряд"""
+        with self._lock, self._writer:
+            self._writer.execute(_SQL_RESET_429, (account_id,))
 
     def close(self) -> None:
-        """Закрывает соединение с базой данных"""
-        self.conn.close()
+        """Закрывает соединения с базой данных"""
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self._writer.close()
 
 
 class ConsoleMonitor:
+    # Признаки 429 ошибки в сообщениях консоли
+    _ERROR_RE = re.compile(r"429|Too Many Requests|CORS header|Http failure response")
+
     def __init__(self) -> None:
         self._429_detected = False
-        self.console_messages = []
+        self.console_messages: deque[str] = deque(maxlen=20)  # Храним только последние сообщения
 
     def handle_console_message(self, msg):
         """Обработчик сообщений из консоли браузера"""
@@ -127,16 +232,159 @@ class ConsoleMonitor:
         self.console_messages.append(message)
 
         # Проверяем признаки 429 ошибки
-        error_indicators = ["429", "Too Many Requests", "CORS header", "Http failure response"]
-        if any(indicator in message for indicator in error_indicators):
+        if self._ERROR_RE.search(message):
             log(f"Обнаружена 429 ошибка в консоли: {message}")
             self._429_detected = True
 
 
+class TooManyRequestsError(Exception):
+    """Сервер ответил 429 Too Many Requests"""
+
+    def __init__(self, url: str, retry_after: Optional[str] = None) -> None:
+        super().__init__(f"429 Too Many Requests: {url}")
+        self.retry_after = retry_after
+
+
+class HostPausedError(Exception):
+    """Лимит запросов к хосту исчерпан, проверку аккаунта нужно отложить до следующего цикла"""
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов к одному хосту"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate  # Токенов в секунду
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float) -> Optional[float]:
+        """Забирает токен и возвращает время ожидания в секундах перед запросом.
+        Если ждать пришлось бы дольше max_wait, токен не забирается и возвращается None"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            delay = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            delay = max(delay, self._paused_until - now)
+            if delay > max_wait:
+                return None
+
+            self._tokens -= 1
+            return delay
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов, например после 429"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# Блокировка через настройки Firefox, а не page.route: перехват запросов отключает HTTP-кэш,
+# и постоянный профиль аккаунта перестал бы кэшировать JS сайта. Картинки блокирует сам Camoufox (block_images)
+_BLOCK_RESOURCES_PREFS = {
+    "gfx.downloadable_fonts.enabled": False,
+    "media.autoplay.default": 5,
+    # Встроенная защита от отслеживания: google-analytics, doubleclick, hotjar и т.п.
+    "privacy.trackingprotection.enabled": True,
+}
+
+
+class BrowserPool:
+    """Пул долгоживущих браузеров Camoufox с постоянным профилем для каждого аккаунта"""
+
+    def __init__(self, profiles_dir: str = "profiles") -> None:
+        self.profiles_dir = Path(profiles_dir)
+        # Sync API Playwright привязан к потоку, поэтому у каждого потока свой Playwright и свои браузеры
+        self._local = threading.local()
+
+    def __enter__(self) -> "BrowserPool":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def _contexts(self) -> dict[int, BrowserContext]:
+        """Браузеры, запущенные в текущем потоке"""
+        if not hasattr(self._local, "contexts"):
+            self._local.contexts = {}
+        return self._local.contexts
+
+    def _launch(self, account_id: int) -> BrowserContext:
+        """Запускает браузер с профилем аккаунта, чтобы кэш сайта сохранялся между проверками"""
+        from camoufox.sync_api import NewBrowser
+        from playwright.sync_api import sync_playwright
+
+        if getattr(self._local, "playwright", None) is None:
+            self._local.playwright = sync_playwright().start()
+
+        profile = self.profiles_dir / f"acct_{account_id}"
+        profile.mkdir(parents=True, exist_ok=True)
+
+        context = NewBrowser(
+            self._local.playwright,
+            humanize=True,
+            headless=os.getenv("HEADLESS"),
+            persistent_context=True,
+            user_data_dir=str(profile),
+            block_images=BLOCK_RESOURCES,
+            firefox_user_prefs=_BLOCK_RESOURCES_PREFS if BLOCK_RESOURCES else None,
+        )
+        # Если браузер упадет, при следующей проверке он будет запущен заново
+        contexts = self._contexts
+        context.on("close", lambda _: contexts.pop(account_id, None))
+        return context
+
+    @contextlib.contextmanager
+    def new_page(self, account_id: int) -> Iterator[Page]:
+        """Выдает новую страницу в браузере аккаунта и закрывает ее после использования"""
+        context = self._contexts.get(account_id)
+        if context is None:
+            context = self._contexts[account_id] = self._launch(account_id)
+
+        # Вход всегда начинается с чистой сессии, HTTP-кэш профиля при этом сохраняется
+        context.clear_cookies()
+        page = context.new_page()
+        try:
+            yield page
+        finally:
+            page.close()
+
+    def close(self) -> None:
+        """Закрывает браузеры, запущенные в текущем потоке"""
+        contexts = self._contexts
+        while contexts:
+            _, context = contexts.popitem()
+            with contextlib.suppress(Exception):
+                context.close()
+        if getattr(self._local, "playwright", None):
+            self._local.playwright.stop()
+            self._local.playwright = None
+
+
 class AppointmentChecker:
-    def __init__(self, db: AccountDB) -> None:
+    # Признаки 429 ошибки в тексте страницы и в исключениях
+    _429_RE = re.compile(r"429|Too Many Requests")
+
+    def __init__(self, db: AccountDB, browsers: BrowserPool) -> None:
         self.db = db
-        self.console_monitor = ConsoleMonitor()
+        self.browsers = browsers
+        self._local = threading.local()
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._xhr_logged = False
+        self._buckets: defaultdict[str, TokenBucket] = defaultdict(
+            lambda: TokenBucket(HOST_REQUESTS_PER_MINUTE / 60, HOST_BURST)
+        )
+
+    @property
+    def console_monitor(self) -> ConsoleMonitor:
+        """Монитор консоли текущего потока: аккаунты разных хостов проверяются параллельно"""
+        if not hasattr(self._local, "console_monitor"):
+            self._local.console_monitor = ConsoleMonitor()
+        return self._local.console_monitor
 
     @staticmethod
     def save_error_page(page: Page, error_type: str = "error") -> tuple[None, None] | tuple[Path, Path]:
@@ -146,16 +394,15 @@ class AppointmentChecker:
         errors_dir = Path("errors")
         errors_dir.mkdir(exist_ok=True)
         html_filename = errors_dir / f"{error_type}_{timestamp}.html"
-        screenshot_filename = errors_dir / f"{error_type}_{timestamp}.png"
+        screenshot_filename = errors_dir / f"{error_type}_{timestamp}.jpg"
 
         try:
             # Сохраняем HTML
-            with open(html_filename, "w", encoding="utf-8") as f:
-                f.write(page.content())
+            html_filename.write_text(page.content(), encoding="utf-8")
             log(f"Страница сохранена как {html_filename}")
 
-            # Делаем скриншот
-            page.screenshot(path=screenshot_filename)
+            # Делаем скриншот видимой области в JPEG, он в разы меньше полного PNG
+            page.screenshot(path=screenshot_filename, full_page=False, type="jpeg", quality=60)
             log(f"Скриншот сохранен как {screenshot_filename}")
 
             return html_filename, screenshot_filename
@@ -164,21 +411,30 @@ class AppointmentChecker:
             return None, None
 
     @staticmethod
-    def send_telegram_notification(message: str, files: Optional[list[Path]] = None) -> None:
-        """Отправляет уведомление в Telegram"""
-        base_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+    def send_telegram_notification(
+        message: str,
+        files: Optional[list[Path]] = None,
+        exc_info: Optional[tuple[type[BaseException], BaseException, TracebackType]] = None,
+    ) -> None:
+        """Отправляет уведомление в Telegram. Traceback из exc_info форматируется только перед отправкой"""
+        if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
+            log("Telegram не настроен, уведомление не отправлено")
+            return
 
         try:
+            if exc_info:
+                message += "\n" + "".join(traceback.format_exception(*exc_info))
+
             # Отправка текстового сообщения
-            response = requests.post(f"{base_url}/sendMessage", params={"chat_id": TELEGRAM_CHAT_ID, "text": message})
+            response = telegram_session().post(_TG_MSG_URL, params={"chat_id": TELEGRAM_CHAT_ID, "text": message})
             response.raise_for_status()
             log("Уведомление в Telegram отправлено успешно")
 
             # Отправка файлов, если они есть
             for file in files:
                 with open(file, "rb") as f:
-                    response = requests.post(
-                        f"{base_url}/sendDocument", data={"chat_id": TELEGRAM_CHAT_ID}, files={"document": f}
+                    response = telegram_session().post(
+                        _TG_DOC_URL, data={"chat_id": TELEGRAM_CHAT_ID}, files={"document": f}
                     )
                     response.raise_for_status()
                     log(f"Файл {file} отправлен в Telegram")
@@ -189,9 +445,7 @@ class AppointmentChecker:
         """Проверяет наличие 429 ошибки на странице или в консоли"""
         try:
             # Проверка текста страницы
-            page_text = page.inner_text("body")
-            error_indicators = ["429", "Too Many Requests"]
-            if any(indicator in page_text for indicator in error_indicators):
+            if self._429_RE.search(page.inner_text("body")):
                 return True
 
             # Проверка через монитор консоли
@@ -199,22 +453,57 @@ class AppointmentChecker:
         except Exception:
             return False
 
-    def handle_429_error(self, account: dict, page: Page) -> bool:
+    def wait_for_host(self, url: str) -> None:
+        """Выдерживает короткую паузу перед запросом к хосту. Если лимит исчерпан надолго,
+        выбрасывает HostPausedError, чтобы не блокировать поток проверки"""
+        host = urlparse(url).hostname
+        delay = self._buckets[host].acquire(HOST_MAX_WAIT_SECONDS)
+        if delay is None:
+            raise HostPausedError(f"Лимит запросов к {host} исчерпан")
+        if delay > 0:
+            log(f"Лимит запросов к {host}, ожидание {delay:.0f} сек")
+            time.sleep(delay)
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """Разбирает заголовок Retry-After: число секунд или HTTP-дата"""
+        if not value:
+            return None
+
+        # delay-seconds по RFC 9110 - только цифры; float() пропустил бы "nan" и "inf"
+        value = value.strip()
+        if value.isascii() and value.isdigit():
+            return int(value)
+        with contextlib.suppress(TypeError, ValueError):
+            return (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        return None
+
+    def handle_429_error(self, account: dict, page: Page, retry_after: Optional[str] = None) -> bool:
         """Обработка ситуации с 429 ошибкой"""
 
         html_file, screenshot_file = self.save_error_page(page, "429_error")
+        retry_after_seconds = self.parse_retry_after(retry_after)
+
+        # Откладываем аккаунт по Retry-After, а без него - экспоненциально с джиттером
+        if retry_after_seconds is not None:
+            delay = min(max(retry_after_seconds, 30), 3600)
+        else:
+            delay = min(ACCOUNT_DELAY_MINUTES * 60 * 2 ** account.get("consecutive_429", 0), 3600)
+            delay += random.uniform(0, 30)
+        delay_minutes = round(delay / 60, 1)
+        self.db.register_429(account["id"], next_check=datetime.now() + timedelta(seconds=delay))
 
-        # Устанавливаем время следующей проверки для этого аккаунта
-        next_check = datetime.now() + timedelta(minutes=ACCOUNT_DELAY_MINUTES)
-        self.db.update_account_status(account["id"], is_blocked=True, next_check=next_check)
+        # На то же время притормаживаем все проверки на этом хосте
+        host = urlparse(account["login_url"]).hostname
+        self._buckets[host].pause(delay)
 
-        log(f"Обнаружена 429 ошибка. Откладываем аккаунт на {ACCOUNT_DELAY_MINUTES} минут")
+        log(f"Обнаружена 429 ошибка. Откладываем аккаунт на {delay_minutes} минут")
 
         # Формируем сообщение с логами из консоли
-        console_logs = "\n".join(self.console_monitor.console_messages[-10:])
+        console_logs = "\n".join(list(self.console_monitor.console_messages)[-10:])
         message = (
             f"⏳ Обнаружена 429 ошибка в аккаунте для {account['location']}. "
-            f"Аккаунт приостановлен на {ACCOUNT_DELAY_MINUTES} мин\n"
+            f"Аккаунт приостановлен на {delay_minutes} мин\n"
             f"Последние логи консоли:\n{console_logs}"
         )
 
@@ -225,8 +514,17 @@ class AppointmentChecker:
         self.console_monitor._429_detected = False
         return True
 
-    def safe_click(self, page: Page, selector: str, timeout: int = TIMEOUT, retries: int = MAX_RETRIES) -> bool | None:
-        """Безопасный клик с обработкой ошибок и повторными попытками"""
+    def safe_click(
+        self,
+        page: Page,
+        selector: str,
+        timeout: int = TIMEOUT,
+        retries: int = MAX_RETRIES,
+        next_selector: Optional[str] = None,
+        gone_selector: Optional[str] = None,
+    ) -> bool | None:
+        """Безопасный клик с обработкой ошибок и повторными попытками.
+        Вместо фиксированной паузы ждет, пока исчезнет gone_selector и/или появится next_selector"""
 
         for attempt in range(retries):
             try:
@@ -240,8 +538,7 @@ class AppointmentChecker:
                     continue
 
                 element.click()
-                time.sleep(1)  # Пауза после клика
-                return True
+                break
 
             except Exception as e:
                 error_msg = str(e)
@@ -253,7 +550,21 @@ class AppointmentChecker:
                     raise e
 
                 time.sleep(5)
-        return None
+        else:
+            return None
+
+        # Ожидание следующего шага не входит в повторы: после клика страница могла уйти дальше,
+        # и повторный клик по тому же селектору отправил бы форму еще раз
+        try:
+            if gone_selector:
+                page.wait_for_selector(gone_selector, state="hidden", timeout=timeout)
+            if next_selector:
+                page.wait_for_selector(next_selector, timeout=timeout)
+        except Exception as e:
+            log(f"После клика на {selector} не дождались следующего шага: {e}")
+            self.save_error_page(page, "next_step_error")
+            return False
+        return True
 
     def perform_login_actions(self, page: Page, password: str) -> bool:
         """Выполняет последовательность действий для входа в систему"""
@@ -267,14 +578,15 @@ class AppointmentChecker:
             ("#onetrust-accept-btn-handler", "Принятие cookies"),
         ]
 
-        for selector, description, *extra in actions:
+        for index, (selector, description, *extra) in enumerate(actions):
             log(description)
 
             if selector == "#password":
                 page.fill(selector, extra[0])
                 continue
 
-            if not self.safe_click(page, selector):
+            next_selector = actions[index + 1][0] if index + 1 < len(actions) else None
+            if not self.safe_click(page, selector, next_selector=next_selector):
                 return False
 
         return True
@@ -292,46 +604,112 @@ class AppointmentChecker:
 
                 if not response or response.status == 429 or self.is_429_error(page):
                     log("Обнаружена 429 ошибка при загрузке страницы")
-                    return self.handle_429_error(account, page)
+                    retry_after = response.headers.get("retry-after") if response else None
+                    return self.handle_429_error(account, page, retry_after=retry_after)
 
                 if not self.perform_login_actions(page, account["password"]):
                     continue
 
+                if account.get("consecutive_429"):
+                    self.db.reset_429(account["id"])
                 return True
 
             except Exception as e:
                 error_msg = str(e)
                 log(f"Ошибка входа (попытка {attempt + 1}): {error_msg}")
 
-                if "429" in error_msg or "Too Many Requests" in error_msg:
+                if self._429_RE.search(error_msg):
                     return self.handle_429_error(account, page)
 
                 if attempt == MAX_RETRIES - 1:
                     html_file, screenshot_file = self.save_error_page(page, "login_error")
-                    error_message = (
-                        f"Ошибка входа после {MAX_RETRIES} попыток для {location}:\n"
-                        f"{error_msg}\n{traceback.format_exc()}"
-                    )
+                    error_message = f"Ошибка входа после {MAX_RETRIES} попыток для {location}:\n{error_msg}"
                     self.send_telegram_notification(
-                        error_message, [html_file, screenshot_file] if html_file and screenshot_file else None
+                        error_message,
+                        [html_file, screenshot_file] if html_file and screenshot_file else None,
+                        exc_info=sys.exc_info(),
                     )
                     return False
 
                 time.sleep(10)
         return False
 
+    @staticmethod
+    def log_xhr_request(request: Request) -> None:
+        """Логирует XHR-запросы страницы для поиска эндпоинта со слотами"""
+        if request.resource_type in ("xhr", "fetch"):
+            log(f"XHR {request.method} {request.url}")
+
+    def fetch_slots_via_api(self, account: dict, page: Page) -> Optional[bool]:
+        """Проверяет наличие слотов запросом к API с cookies авторизованной сессии.
+        Возвращает None, если ответ не в ожидаемом формате и нужна проверка через интерфейс"""
+
+        url = SLOTS_API_URL.format(location=quote(account["location"]))
+        response = page.context.request.get(url, timeout=TIMEOUT)
+        if response.status == 429:
+            raise TooManyRequestsError(response.url, response.headers.get("retry-after"))
+
+        if not response.ok:
+            log(f"API слотов вернул статус {response.status}, проверяем через интерфейс")
+            return None
+
+        try:
+            data = response.json()
+        except Exception as e:
+            log(f"Не удалось разобрать ответ API слотов: {e}")
+            return None
+
+        # Отсутствие слотов считаем достоверным, только если ключ есть и пуст;
+        # любой другой ответ (ошибка со статусом 200, чужой эндпоинт) проверяется через интерфейс
+        if not isinstance(data, dict) or "earliestDate" not in data:
+            log("Неожиданный формат ответа API слотов, проверяем через интерфейс")
+            return None
+        return bool(data["earliestDate"])
+
+    def skip_ui_check_via_api(self, account: dict, page: Page) -> bool:
+        """Проверяет слоты через API. Возвращает True, если проверка через интерфейс не нужна:
+        API достоверно сообщил об отсутствии слотов или ответил 429"""
+        if not SLOTS_API_URL:
+            # Без эндпоинта логируем XHR первой проверки, чтобы его можно было найти
+            if not self._xhr_logged:
+                page.on("request", self.log_xhr_request)
+                self._xhr_logged = True
+            return False
+
+        try:
+            available = self.fetch_slots_via_api(account, page)
+        except TooManyRequestsError as e:
+            log(f"Ошибка при проверке {account['location']}: {str(e)}")
+            self.handle_429_error(account, page, retry_after=e.retry_after)
+            return True
+
+        if available is False:
+            log(f"Нет доступных слотов в {account['location']} (API)")
+            return True
+        return False
+
     def check_location_availability(self, account: dict, page: Page) -> bool:
         """Проверяет доступность записи в указанной локации"""
+        from playwright._impl import _errors as pw_errors
 
         location = account["location"]
         try:
+            # Быстрая проверка через API, интерфейс нужен только для бронирования найденного слота
+            if self.skip_ui_check_via_api(account, page):
+                return False
+
             log(f"Проверка локации {location}")
-            self.safe_click(page, ".ng-input")
+            self.safe_click(page, ".ng-input", next_selector=f"div.location-name:has-text('{location}')")
 
             self.safe_click(page, f"div.location-name:has-text('{location}')")
 
             log("Нажатие кнопки 'Продолжить'")
-            self.safe_click(page, ".btn-lg")
+            # count() не ждет появления слотов, поэтому дожидаемся либо попапа, либо списка времени
+            if not self.safe_click(
+                page, ".btn-lg", next_selector="modal-container div.modal-content, li.btn.btn-link.appointment-btn"
+            ):
+                log(f"Не дождались результата поиска слотов в {location}")
+                return False
 
             # Проверка модального окна
             with contextlib.suppress(pw_errors.TimeoutError):
@@ -368,21 +746,30 @@ class AppointmentChecker:
 
             selected_slot.click()
 
-            self.safe_click(page, "button.btn.btn-primary-vfs.btn-lg")
+            # Кнопка следующего шага совпадает по селектору (SPA может оставить тот же элемент),
+            # поэтому признак перехода - исчезновение списка слотов, который есть только на первом этапе
+            if not self.safe_click(
+                page, "button.btn.btn-primary-vfs.btn-lg", gone_selector="li.btn.btn-link.appointment-btn"
+            ):
+                log(f"Не удалось перейти ко второму этапу записи в {location}")
+                return False
             log("Успешно выбрано время и нажата кнопка Continue")
 
-            self.safe_click(page, "button.btn.btn-primary-vfs.btn-lg")
+            self.safe_click(page, "button.btn.btn-primary-vfs.btn-lg", next_selector="#read-agree")
             log("Нажата кнопка Continue на втором этапе")
 
             self.safe_click(page, "#read-agree")
             self.safe_click(page, "button.ng-star-inserted")
             log("Пройден третий этап записи")
 
+            # Даем отрисоваться подтверждению, иначе в файл попадет страница до ответа сервера
+            page.wait_for_load_state()
+            with contextlib.suppress(pw_errors.TimeoutError):
+                page.wait_for_load_state("networkidle", timeout=TIMEOUT)
+
             # Сохраняем последнюю страницу
-            html = page.content()
-            filename = f"available_{location.replace(' ', '_')}_{int(time.time())}.html"
-            with open(filename, "w", encoding="utf-8") as f:
-                f.write(html)
+            filename = Path(f"available_{location.replace(' ', '_')}_{int(time.time())}.html")
+            filename.write_text(page.content(), encoding="utf-8")
             log(f"Страница сохранена как {filename}")
 
             message = f"🚀 Удачная запись в {location}! Файл: {filename}"
@@ -393,16 +780,23 @@ class AppointmentChecker:
         except Exception as e:
             log(f"Ошибка при проверке {location}: {str(e)}")
             self.save_error_page(page, f"location_error_{location}")
-            if "429" in str(e) or "Too Many Requests" in str(e):
+            if self._429_RE.search(str(e)):
                 self.handle_429_error(account, page)
             return False
 
     def check_account(self, account: dict) -> None:
         """Проверяет один аккаунт"""
-        with Camoufox(humanize=True, headless=os.getenv("HEADLESS")) as browser:
-            page = browser.new_page()
+        location = account["location"]
+        # Один токен хоста на всю проверку (вход, повторы, API слотов). Берется до отметки о проверке,
+        # поэтому отложенный аккаунт останется первым в очереди
+        try:
+            self.wait_for_host(account["login_url"])
+        except HostPausedError as e:
+            log(f"{e}, проверка {location} отложена до следующего цикла")
+            return
+
+        with self.browsers.new_page(account["id"]) as page:
             try:
-                location = account["location"]
                 self.db.update_account_status(account["id"])
 
                 if not self.login(account, page):
@@ -416,11 +810,11 @@ class AppointmentChecker:
             except Exception as e:
                 log(f"Критическая ошибка при проверке {location}: {str(e)}")
                 html_file, screenshot_file = self.save_error_page(page, "critical_error")
-                error_message = (
-                    f"🔥 Критическая ошибка в скрипте для {location}:\n" f"{str(e)}\n{traceback.format_exc()}"
-                )
+                error_message = f"🔥 Критическая ошибка в скрипте для {location}:\n{str(e)}"
                 self.send_telegram_notification(
-                    error_message, [html_file, screenshot_file] if html_file and screenshot_file else None
+                    error_message,
+                    [html_file, screenshot_file] if html_file and screenshot_file else None,
+                    exc_info=sys.exc_info(),
                 )
 
     def run_check(self) -> None:
@@ -432,46 +826,74 @@ class AppointmentChecker:
             log("Нет активных аккаунтов для проверки")
             return
 
+        # Аккаунты одного хоста проверяются по очереди, разных хостов - параллельно
+        groups: defaultdict[str, list[dict]] = defaultdict(list)
+        for account in accounts:
+            groups[urlparse(account["login_url"]).hostname].append(account)
+
+        futures = [self._executor(host).submit(self.check_accounts, group) for host, group in groups.items()]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                log(f"Ошибка в потоке проверки: {e}")
+
+        log("=== Проверка аккаунтов завершена ===")
+
+    def check_accounts(self, accounts: list[dict]) -> None:
+        """Последовательно проверяет аккаунты одного хоста"""
         for account in accounts:
             log(f"\nПроверка аккаунта для {account['location']}")
             self.check_account(account)
             time.sleep(5)  # Небольшая пауза между аккаунтами
 
-        log("=== Проверка аккаунтов завершена ===")
+    def _executor(self, host: str) -> ThreadPoolExecutor:
+        """Возвращает поток проверки хоста. Поток живет между циклами, так как браузеры привязаны к нему"""
+        if host not in self._executors:
+            self._executors[host] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"check-{host}")
+        return self._executors[host]
+
+    def close(self) -> None:
+        """Закрывает браузеры в потоках проверки и останавливает потоки"""
+        for executor in self._executors.values():
+            executor.submit(self.browsers.close).result()
+            executor.shutdown()
+        self._executors.clear()
 
 
 def main():
     """Основная функция запуска приложения"""
     db = AccountDB()
-    checker = AppointmentChecker(db)
 
     # Добавляем тестовые аккаунты, если их нет в базе
     if not db.get_active_accounts():
-        db.add_account(
-            os.getenv("ACCOUNT1_LOGIN_URL"),
-            os.getenv("ACCOUNT1_PASSWORD"),
-            "Moscow",
-        )
-        db.add_account(
-            os.getenv("ACCOUNT2_LOGIN_URL"),
-            os.getenv("ACCOUNT2_PASSWORD"),
-            "St Petersburg",
+        db.add_accounts(
+            [
+                (os.getenv("ACCOUNT1_LOGIN_URL"), os.getenv("ACCOUNT1_PASSWORD"), "Moscow"),
+                (os.getenv("ACCOUNT2_LOGIN_URL"), os.getenv("ACCOUNT2_PASSWORD"), "St Petersburg"),
+            ]
         )
 
-    # Настраиваем периодическую проверку
-    schedule.every(CHECK_INTERVAL_MINUTES).minutes.do(checker.run_check)
+    with BrowserPool() as browsers:
+        checker = AppointmentChecker(db, browsers)
 
-    # Первый запуск сразу
-    checker.run_check()
+        # Планировщик спит до следующей проверки вместо ежесекундного опроса
+        scheduler = sched.scheduler(time.monotonic, time.sleep)
 
-    # Бесконечный цикл для работы планировщика
-    try:
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
-    except KeyboardInterrupt:
-        db.close()
-        log("Скрипт остановлен")
+        def tick() -> None:
+            scheduler.enter(CHECK_INTERVAL_MINUTES * 60, 1, tick)
+            checker.run_check()
+
+        # Первый запуск сразу
+        scheduler.enter(0, 1, tick)
+
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            log("Скрипт остановлен")
+        finally:
+            checker.close()
+            db.close()
 
 
 if __name__ == "__main__":